@@ -7,13 +7,31 @@ load_dotenv()
 
 TOKEN = os.getenv("TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL") or "http://localhost:8000/webhook"
+AUDIO_EXTS = ('.mp3', '.wav', '.ogg', '.m4a')
 
 # Enable intents to receive message events including DMs
 intents = discord.Intents.default()
 intents.messages = True
 intents.dm_messages = True
 
-bot = discord.Client(intents=intents)
+class Bot(discord.Client):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Shared HTTP session, reused across messages to keep connections alive
+        self.http_session = None
+
+    async def setup_hook(self):
+        # Runs once before connecting, so the session exists before any event is dispatched
+        self.http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=60)
+        )
+
+    async def close(self):
+        if self.http_session is not None:
+            await self.http_session.close()
+        await super().close()
+
+bot = Bot(intents=intents)
 
 @bot.event
 async def on_ready():
@@ -29,22 +47,24 @@ async def on_message(message):
         # Check it there is an attachment
         if message.attachments:
             for attachment in message.attachments:
-                if any(attachment.filename.lower().endswith(ext) for ext in ['.mp3', '.wav', '.ogg', '.m4a']):
-                    # Get file bytes
-                    audio_bytes = await attachment.read()
+                if attachment.filename.lower().endswith(AUDIO_EXTS):
+                    # Stream the file from Discord CDN straight to the webhook
+                    async with bot.http_session.get(attachment.url) as src:
+                        if src.status != 200:
+                            print(f"Failed to download attachment: {src.status}")
+                            continue
 
-                    # Send file to webhook
-                    async with aiohttp.ClientSession() as session:
                         data = aiohttp.FormData()
-                        data.add_field('file', audio_bytes,
+                        data.add_field('file', src.content,
                                         filename=attachment.filename,
                                         content_type=attachment.content_type or 'application/octet-stream')
 
                         data.add_field('author', str(message.author))
                         data.add_field('reference_id', str(message.reference.message_id) if message.reference else '')
 
-                        async with session.post(WEBHOOK_URL, data=data) as resp:
-                            if resp.status == 200:
+                        # Send file to webhook
+                        async with bot.http_session.post(WEBHOOK_URL, data=data) as resp:
+                            if resp.status in (200, 202):
                                 print(f"File sent to webhook successfully: {attachment.filename}")
                             else:
                                 print(f"Failed to send file to webhook: {resp.status}")
@@ -1,38 +1,138 @@
-import requests
 from fastapi.exceptions import HTTPException
-from fastapi import FastAPI
+from fastapi import FastAPI, BackgroundTasks
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from fastapi import UploadFile, File, Form
 from datetime import datetime
+from collections import OrderedDict
 
 import os
 import logging
+import asyncio
+import uuid
+import aiofiles
+import torch
 
 from services.text_to_speech import is_tts_model_loaded, load_tts_model, text_to_speech
 from services.speech_to_text import is_stt_model_loaded, load_stt_model, speech_to_text
-from services.message_sender import send_voice_dm
-from services.openai_client import prompt_ai
+from services.message_sender import start_discord_client, send_voice_dm
+from services.openai_client import prompt_ai, close_client
+from middlewares.size_limit import SizeLimitMiddleware
 
 from models.TextModel import Text
 
 app = FastAPI()
 load_dotenv()
 
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 100 * 1024 * 1024))
+app.add_middleware(SizeLimitMiddleware, max_content_size=MAX_UPLOAD_BYTES)
+
 TOKEN = os.getenv("TOKEN")
+DISCORD_READY_TIMEOUT = float(os.getenv("DISCORD_READY_TIMEOUT", "30"))
 USER_ID = int(os.getenv("USER_ID", 0))
 OPENAI_URL = os.getenv("OPENAI_URL", 'http://localhost:8008/v1/')
 RECEIVED_FILE_PATH = 'files/received_audios'
 SENT_FILE_PATH = 'files/sent_audios'
 VOICE_FILE = 'recording'
-
-conversations = {}
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Limit how many requests run the models at the same time
+TTS_SEM = asyncio.Semaphore(int(os.getenv("MAX_TTS_CONCURRENCY", "1")))
+WEBHOOK_SEM = asyncio.Semaphore(int(os.getenv("MAX_WEBHOOK_CONCURRENCY", "2")))
+
+CONVERSATION_LOGS_FILE = 'files/conversation_logs.txt'
+LOG_BATCH_SIZE = 64
+LOG_Q = asyncio.Queue()
+
+# Bounded LRUs of the conversations and background tasks, oldest ones are dropped first
+MAX_CONVERSATIONS = int(os.getenv("MAX_CONVERSATIONS", "10000"))
+MAX_TASKS = int(os.getenv("MAX_TASKS", "10000"))
+conversations = OrderedDict()
+tasks = OrderedDict()
+
+def lru_put(store, key, value, max_size):
+    store[key] = value
+    store.move_to_end(key)
+    if len(store) > max_size:
+        store.popitem(last=False)
+
+def save_conversation(reference_id, conversation):
+    lru_put(conversations, reference_id, conversation, MAX_CONVERSATIONS)
+
+def new_task():
+    task_id = uuid.uuid4().hex
+    task = {"id": task_id, "status": "pending", "detail": None}
+    lru_put(tasks, task_id, task, MAX_TASKS)
+    return task
+
+async def run_task(task, func, *args):
+    task["status"] = "running"
+    try:
+        await func(*args)
+        task["status"] = "done"
+    except HTTPException as e:
+        task["status"] = "failed"
+        task["detail"] = e.detail
+    except Exception as e:
+        logging.exception(f"Task {task['id']} failed.")
+        task["status"] = "failed"
+        task["detail"] = "Internal error."
 
 @app.on_event("startup")
 def startup():
+    # Torch threads are process-wide, set them before any model is loaded
+    if os.getenv("TORCH_THREADS"):
+        torch.set_num_threads(int(os.getenv("TORCH_THREADS")))
+        torch.set_num_interop_threads(1)
+
     print(" --- Loading Text-to-Speech model... --- ")
-    load_tts_model()
+    app.state.tts = load_tts_model()
     print(" --- Loading Speech-to-Text model... ---")
-    load_stt_model()
+    app.state.stt = load_stt_model()
+
+def on_discord_stopped(task):
+    # Surface a gateway failure that happens after startup
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Discord client stopped.", exc_info=task.exception())
+
+@app.on_event("startup")
+async def start_discord():
+    app.state.discord = None
+    app.state.discord_task = None
+    try:
+        app.state.discord, app.state.discord_task = await start_discord_client(TOKEN, DISCORD_READY_TIMEOUT)
+        app.state.discord_task.add_done_callback(on_discord_stopped)
+    except Exception as e:
+        logging.exception("Failed to connect the Discord client.")
+
+async def log_writer():
+    # Drain the queue and write the pending records in a single call
+    while True:
+        batch = [await LOG_Q.get()]
+        while not LOG_Q.empty() and len(batch) < LOG_BATCH_SIZE:
+            batch.append(LOG_Q.get_nowait())
+        try:
+            async with aiofiles.open(CONVERSATION_LOGS_FILE, 'a') as f:
+                await f.write(''.join(batch))
+        except Exception as e:
+            logging.exception("Failed to write conversation logs.")
+        finally:
+            for _ in batch:
+                LOG_Q.task_done()
+
+@app.on_event("startup")
+async def start_log_writer():
+    app.state.log_writer = asyncio.create_task(log_writer())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await LOG_Q.join()
+    app.state.log_writer.cancel()
+    await close_client()
+    if app.state.discord is not None:
+        await app.state.discord.close()
+        # Failures are already logged by on_discord_stopped
+        await asyncio.gather(app.state.discord_task, return_exceptions=True)
 
 @app.get("/")
 def root():
@@ -44,33 +144,44 @@ def health_check():
 
 @app.get("/readyz")
 def readiness_check():
-    if is_tts_model_loaded() and is_stt_model_loaded():
+    if is_tts_model_loaded(app.state.tts) and is_stt_model_loaded(app.state.stt):
         return {"status": 200, "message": "OK"}
     else:
         return {"status": 500, "message": "Loading"}
 
-@app.post("/tts")
-async def tts(body: Text):
-
-    filepath = f'{SENT_FILE_PATH}/{VOICE_FILE}.ogg'
-
-    try:
-        text_to_speech(body.prompt, filepath)
-    except Exception as e:
-        logging.exception("Text-to-speech generation failed.")
-        raise HTTPException(status_code=500, detail="Failed to generate voice file.")
-
-    # Check file existence
-    if not os.path.exists(filepath):
-        logging.error(f"Voice file not found at expected path: {filepath}")
-        raise HTTPException(status_code=500, detail="Voice file was not created successfully.")
-    
-    # Send the file
-    try:
-        message_sent = await send_voice_dm(TOKEN, USER_ID, filepath)
-    except Exception as e:
-        logging.exception("Failed to send voice DM.")
-        raise HTTPException(status_code=500, detail="Failed to send voice message.")
+@app.get("/tasks/{task_id}")
+def task_status(task_id: str):
+    task = tasks.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Unknown task.")
+    return task
+
+async def generate_and_send_voice(prompt: str):
+    async with TTS_SEM:
+        # Unique file per request so concurrent calls never share a recording
+        filepath = f'{SENT_FILE_PATH}/{VOICE_FILE}-{uuid.uuid4().hex}.ogg'
+
+        try:
+            try:
+                await asyncio.to_thread(text_to_speech, app.state.tts, prompt, filepath)
+            except Exception as e:
+                logging.exception("Text-to-speech generation failed.")
+                raise HTTPException(status_code=500, detail="Failed to generate voice file.")
+
+            # Check file existence
+            if not os.path.exists(filepath):
+                logging.error(f"Voice file not found at expected path: {filepath}")
+                raise HTTPException(status_code=500, detail="Voice file was not created successfully.")
+
+            # Send the file
+            try:
+                message_sent = await send_voice_dm(app.state.discord, USER_ID, filepath)
+            except Exception as e:
+                logging.exception("Failed to send voice DM.")
+                raise HTTPException(status_code=500, detail="Failed to send voice message.")
+        finally:
+            if os.path.exists(filepath):
+                os.unlink(filepath)
 
     # Example of the conversations dictionary:
     # conversations = {
@@ -80,34 +191,54 @@ async def tts(body: Text):
     #         "user_answer": "Yes"
     #     }
 
-    conversations[str(message_sent.id)] = {"ai_message": body.prompt, "user_reply": "None", "user_answer": "None"}
-
-    return {"status": 201, "message": "Created"}
+    save_conversation(str(message_sent.id), {"ai_message": prompt, "user_reply": "None", "user_answer": "None"})
 
-@app.post("/webhook")
-async def webhook(file: UploadFile = File(...), author: str = Form(...), reference_id: str = Form(...)):
-    contents = await file.read()
-    print(f"Received file {file.filename} of size {len(contents)} bytes")
-    with open(f'{RECEIVED_FILE_PATH}/{file.filename}', 'wb') as f:
-        f.write(contents)
-
-    user_transcript = speech_to_text(f'{RECEIVED_FILE_PATH}/{file.filename}')
-
-    conversations[reference_id]["user_reply"] = user_transcript
+@app.post("/tts")
+async def tts(body: Text, background_tasks: BackgroundTasks):
+    task = new_task()
+    background_tasks.add_task(run_task, task, generate_and_send_voice, body.prompt)
+    return JSONResponse({"status": 202, "message": "Accepted", "id": task["id"]}, status_code=202)
 
+async def parse_reply(reference_id: str, conversation: dict, filepath: str):
     try:
-        result = await prompt_ai(user_transcript, OPENAI_URL)
-        conversations[reference_id]["user_answer"] = result
-        print(conversations)
-    except HTTPException as e:
-        raise e
-
-    with open(f'files/conversation_logs.txt', 'a') as f:
-        f.write("------------------------------\n")
-        f.write(f"Timestamp: {datetime.now()}\n")
-        f.write(f"Reference ID: {reference_id}\n")
-        f.write(f"AI Message: {conversations[reference_id]['ai_message']}\n")
-        f.write(f"User Reply: {conversations[reference_id]['user_reply']}\n")
-        f.write(f"User Answer: {conversations[reference_id]['user_answer']}\n")
+        async with WEBHOOK_SEM:
+            user_transcript = await asyncio.to_thread(speech_to_text, app.state.stt, filepath)
+
+            conversation["user_reply"] = user_transcript
+
+            result = await prompt_ai(user_transcript, OPENAI_URL)
+            conversation["user_answer"] = result
+            print(conversation)
+    finally:
+        if os.path.exists(filepath):
+            os.unlink(filepath)
+
+    LOG_Q.put_nowait(
+        "------------------------------\n"
+        f"Timestamp: {datetime.now()}\n"
+        f"Reference ID: {reference_id}\n"
+        f"AI Message: {conversation['ai_message']}\n"
+        f"User Reply: {conversation['user_reply']}\n"
+        f"User Answer: {conversation['user_answer']}\n"
+    )
 
-    return {"status": 200, "message": "File received and parsed"}
+@app.post("/webhook")
+async def webhook(background_tasks: BackgroundTasks, file: UploadFile = File(...), author: str = Form(...), reference_id: str = Form(...)):
+    conversation = conversations.get(reference_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Unknown reference.")
+    conversations.move_to_end(reference_id)
+
+    # The upload is only readable during the request, save it before answering
+    # Unique file per request, Discord names every voice note the same
+    filepath = f'{RECEIVED_FILE_PATH}/{uuid.uuid4().hex}-{os.path.basename(file.filename or "audio")}'
+    size = 0
+    async with aiofiles.open(filepath, 'wb') as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+            size += len(chunk)
+    print(f"Received file {file.filename} of size {size} bytes")
+
+    task = new_task()
+    background_tasks.add_task(run_task, task, parse_reply, reference_id, conversation, filepath)
+    return JSONResponse({"status": 202, "message": "File received", "id": task["id"]}, status_code=202)
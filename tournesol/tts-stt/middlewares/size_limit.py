@@ -0,0 +1,39 @@
+from fastapi.exceptions import HTTPException
+from fastapi.responses import JSONResponse
+
+# Reject request bodies bigger than max_content_size with a 413, while they are being received
+class SizeLimitMiddleware:
+    def __init__(self, app, max_content_size: int):
+        self.app = app
+        self.max_content_size = max_content_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            try:
+                content_length = int(content_length)
+            except ValueError:
+                return await self.reject(scope, receive, send, 400, "Invalid Content-Length header.")
+            if content_length > self.max_content_size:
+                return await self.reject(scope, receive, send, 413, "Request body too large.")
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_content_size:
+                    # Turned into a 413 response by FastAPI's exception handling
+                    raise HTTPException(status_code=413, detail="Request body too large.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def reject(self, scope, receive, send, status_code, detail):
+        response = JSONResponse({"detail": detail}, status_code=status_code)
+        await response(scope, receive, send)
@@ -1,31 +1,37 @@
 import discord
 import asyncio
 
-class VoiceSender(discord.Client):
-    def __init__(self, user_id, voice_file_path, result_future, **kwargs):
-        super().__init__(**kwargs)
-        self.user_id = user_id
-        self.voice_file_path = voice_file_path
-        self.result_future = result_future
+async def start_discord_client(token, ready_timeout):
+    intents = discord.Intents.default()
+    client = discord.Client(intents=intents)
 
-    async def on_ready(self):
-        print(f'Logged in as {self.user}')
-        user = await self.fetch_user(self.user_id)
-        try:
-            message_sent = await user.send("Here is your generated voice message 🎧", file=discord.File(self.voice_file_path))
-            print("✅ Voice message sent!")
-            self.result_future.set_result(message_sent)
-        except Exception as e:
-            print(f"❌ Failed to send DM: {e}")
-            self.result_future.set_exception(e)
-        await self.close()
+    # Run the gateway connection in the background for the whole app lifetime
+    task = asyncio.create_task(client.start(token))
+    ready = asyncio.create_task(client.wait_until_ready())
+    done, _ = await asyncio.wait({task, ready}, timeout=ready_timeout, return_when=asyncio.FIRST_COMPLETED)
+    if task in done:
+        ready.cancel()
+        task.result()  # Raise the login error, if any
+        raise RuntimeError("Discord client stopped before being ready.")
 
-async def send_voice_dm(token, user_id, voice_file_path):
-    loop = asyncio.get_event_loop()
-    result_future = loop.create_future()
+    if ready not in done:
+        # start() keeps reconnecting on gateway errors, let it go on in the background
+        ready.cancel()
+        print(f"⚠️ Discord client not ready after {ready_timeout}s, still connecting in the background")
+        return client, task
 
-    intents = discord.Intents.default()
-    client = VoiceSender(user_id, voice_file_path, result_future, intents=intents)
+    print(f'Logged in as {client.user}')
+    return client, task
+
+async def send_voice_dm(client, user_id, voice_file_path):
+    if client is None or not client.is_ready():
+        raise RuntimeError("Discord client is not connected.")
 
-    await client.start(token)
-    return await result_future
+    user = await client.fetch_user(user_id)
+    try:
+        message_sent = await user.send("Here is your generated voice message 🎧", file=discord.File(voice_file_path))
+        print("✅ Voice message sent!")
+        return message_sent
+    except Exception as e:
+        print(f"❌ Failed to send DM: {e}")
+        raise
@@ -2,11 +2,25 @@ from fastapi.exceptions import HTTPException
 import logging
 from openai import AsyncOpenAI
 
-async def prompt_ai(prompt: str, OPENAI_URL: str):
-    client = AsyncOpenAI(api_key="ignored", base_url=OPENAI_URL)
+client = None  # Shared client, keeps the connection pool alive between calls
+client_url = None
+
+def get_client(OPENAI_URL: str):
+    global client, client_url
+    if client is None or client_url != OPENAI_URL:
+        client = AsyncOpenAI(api_key="ignored", base_url=OPENAI_URL)
+        client_url = OPENAI_URL
+    return client
 
+async def close_client():
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+async def prompt_ai(prompt: str, OPENAI_URL: str):
     try:
-        response = await client.chat.completions.create(
+        response = await get_client(OPENAI_URL).chat.completions.create(
             model="gemma3-1b-cpu",
             messages=[
                 {
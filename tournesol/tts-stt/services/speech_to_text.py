@@ -1,18 +1,32 @@
+import os
+import numpy as np
 import torch
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+from dataclasses import dataclass
+from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, Pipeline, pipeline
 
 device = "cpu"
-torch_dtype = torch.float32
+# bfloat16 halves memory bandwidth, but is only fast with native CPU support
+is_bf16_supported = getattr(torch.cpu, "_is_avx512_bf16_supported", lambda: False)
+torch_dtype = torch.bfloat16 if is_bf16_supported() else torch.float32
 model_id = "openai/whisper-base.en"
 
-model_ready = False
-asr_pipeline = None  # Global pipeline
+@dataclass(slots=True)
+class STTState:
+    asr_pipeline: Pipeline | None = None
+    ready: bool = False
 
-def is_stt_model_loaded():
-    return model_ready
+def is_stt_model_loaded(state: STTState):
+    return state.ready
+
+def warmup_stt_model(asr_pipeline: Pipeline):
+    # Transcribe one second of silence so the first real request does not pay the cold start
+    try:
+        with torch.inference_mode():
+            asr_pipeline({"raw": np.zeros(16000, dtype=np.float32), "sampling_rate": 16000})
+    except Exception as e:
+        print(f"❌ Failed to warm up STT model: {e}")
 
 def load_stt_model():
-    global model_ready, asr_pipeline
     try:
         model = AutoModelForSpeechSeq2Seq.from_pretrained(
             model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True
@@ -29,15 +43,18 @@ def load_stt_model():
             torch_dtype=torch_dtype,
             device=0 if device == "cuda" else -1,
         )
-
-        model_ready = True
     except Exception as e:
         print(f"❌ Failed to load STT model: {e}")
-        model_ready = False
+        return STTState()
+
+    if os.getenv("WARMUP", "1") == "1":
+        warmup_stt_model(asr_pipeline)
+    return STTState(asr_pipeline=asr_pipeline, ready=True)
 
-def speech_to_text(filepath: str):
-    if not model_ready or asr_pipeline is None:
+def speech_to_text(state: STTState, filepath: str):
+    if not state.ready or state.asr_pipeline is None:
         raise RuntimeError("STT model is not loaded. Call load_stt_model() first.")
     
-    result = asr_pipeline(filepath)
+    with torch.inference_mode():
+        result = state.asr_pipeline(filepath)
     return result["text"]
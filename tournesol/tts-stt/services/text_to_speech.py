@@ -1,28 +1,42 @@
+import os
+from dataclasses import dataclass
 from kokoro import KPipeline
-from IPython.display import display, Audio
 import soundfile as sf
 import torch
 
-model_ready = False
+@dataclass(slots=True)
+class TTSState:
+    pipeline: KPipeline | None = None
+    ready: bool = False
 
-def is_tts_model_loaded():
-    return model_ready
+def is_tts_model_loaded(state: TTSState):
+    return state.ready
+
+def warmup_tts_model(pipeline: KPipeline):
+    # Run a tiny synthesis so the first real request does not pay the cold start
+    try:
+        for _ in pipeline("hi.", voice='af_heart'):
+            pass
+    except Exception as e:
+        print(f"Failed to warm up tts model: {e}")
 
 def load_tts_model():
-    global pipeline, model_ready
     try:
         pipeline = KPipeline(lang_code='b')
-        model_ready = True
     except Exception as e:
         print(f"Failed to load tts model: {e}")
-        model_ready = False
+        return TTSState()
+
+    if os.getenv("WARMUP", "1") == "1":
+        warmup_tts_model(pipeline)
+    return TTSState(pipeline=pipeline, ready=True)
 
-def text_to_speech(prompt: str, filepath):
-    if not model_ready or pipeline is None:
+def text_to_speech(state: TTSState, prompt: str, filepath):
+    if not state.ready or state.pipeline is None:
         raise RuntimeError("TTS model is not loaded. Call load_tts_model() first.")
     
-    generator = pipeline(prompt, voice='af_heart')
-    for _, (_, _, audio) in enumerate(generator):
-        #print(i, gs, ps)
-        #display(Audio(data=audio, rate=24000, autoplay=i==0))
-        sf.write(f'{filepath}', audio, 24000)
\ No newline at end of file
+    generator = state.pipeline(prompt, voice='af_heart')
+    # Write every chunk into a single OGG file instead of overwriting it
+    with sf.SoundFile(filepath, 'w', 24000, 1, format='OGG', subtype='VORBIS') as out:
+        for _, _, audio in generator:
+            out.write(audio.cpu().numpy() if hasattr(audio, 'cpu') else audio)